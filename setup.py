@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import os
 from pathlib import Path
 from setuptools import setup, find_packages
 
@@ -10,6 +11,21 @@ version = [
 version = version[0].split(" = ")[-1].strip('"')
 readme_text = Path("./README.md").read_text()
 
+# optionally compile the package to a C extension (requires mypy)
+if os.environ.get("WEB_COMPILE_USE_MYPYC", "0") == "1":
+    from mypyc.build import mypycify
+
+    ext_modules = mypycify(
+        [
+            "--ignore-missing-imports",
+            "web_compile/compilers.py",
+            "web_compile/cache.py",
+            "web_compile/config.py",
+        ]
+    )
+else:
+    ext_modules = []
+
 setup(
     name="web-compile",
     version=version,
@@ -21,6 +37,7 @@ setup(
     url="https://github.com/executablebooks/web-compile",
     license="MIT",
     packages=find_packages(),
+    ext_modules=ext_modules,
     python_requires=">=3.6",
     install_requires=[
         "click>=7.1.2,<10.0.0",
@@ -33,6 +50,7 @@ setup(
     ],
     extras_require={
         "testing": ["pytest~=6.0.1"],
+        "dart": ['sass-embedded; python_version>="3.10"'],
     },
     classifiers=[
         "License :: OSI Approved :: MIT License",
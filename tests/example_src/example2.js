@@ -0,0 +1,17 @@
+// Toggle the sidebar with a button
+var initSidebarToggle = () => {
+  var toggler = document.getElementById("sidebar-toggler")
+  if (toggler) {
+    toggler.addEventListener("click", function () {
+      document.body.classList.toggle("sidebar-hidden")
+    })
+  }
+}
+
+// Copy code cell contents to the clipboard
+function copyCode(button) {
+  var code = button.parentElement.querySelector("pre")
+  navigator.clipboard.writeText(code.innerText)
+}
+
+sbRunWhenDOMLoaded(initSidebarToggle)
@@ -1,3 +1,4 @@
+import json
 import os
 from pathlib import Path
 import shutil
@@ -63,6 +64,147 @@ def test_sass_basic(src_folder: Path):
     assert result.exit_code == 0, result.output
 
 
+def test_git_add(src_folder: Path):
+    config = create_config(
+        src_folder,
+        {
+            "sass_files": {"src/example1.scss": "dist/example1.css"},
+            "js_files": {"src/example1.js": "dist/example1.js"},
+        },
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    indexed = {path for path, _ in Repo(str(src_folder)).index.entries}
+    assert {"dist/example1.css", "dist/example1.js"} <= indexed
+
+
+def test_sass_error(src_folder: Path):
+    (src_folder / "src" / "error.scss").write_text("div {", encoding="utf8")
+    config = create_config(
+        src_folder, {"sass_files": {"src/error.scss": "dist/error.css"}}
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 1, result.output
+    assert "SASS compilation failed" in result.output
+    assert "error.scss" in result.output
+
+
+def test_missing_input(src_folder: Path):
+    config = create_config(
+        src_folder,
+        {
+            "sass_files": {"src/missing.scss": "dist/missing.css"},
+            "continue_on_error": True,
+        },
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 0, result.output
+    config = create_config(
+        src_folder, {"js_files": {"src/missing.js": "dist/missing.js"}}
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 1, result.output
+    assert "Path does not exist" in result.output
+    # the parent of the input is a file
+    config = create_config(
+        src_folder, {"js_files": {"src/example1.js/missing.js": "dist/missing.js"}}
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 1, result.output
+    assert "Path does not exist" in result.output
+
+
+def test_unreadable_input(src_folder: Path):
+    config = create_config(
+        src_folder,
+        {
+            "sass_files": {"src/partials": "dist/partials.css"},
+            "js_files": {"src/partials": "dist/partials.js"},
+            "continue_on_error": True,
+        },
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 1, result.output
+    assert "Compilations failed" in result.output
+    assert "Is a directory" in result.output
+
+
+def test_sass_dart_format_error(src_folder: Path):
+    config = create_config(
+        src_folder,
+        {
+            "sass": {
+                "files": {"src/example1.scss": "dist/example1.css"},
+                "backend": "dart",
+                "format": "nested",
+            }
+        },
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 1, result.output
+    assert "does not support format: nested" in result.output
+
+
+def test_sass_dart(src_folder: Path):
+    pytest.importorskip("sass_embedded")
+    config = create_config(
+        src_folder,
+        {
+            "sass": {
+                "files": {"src/example1.scss": "dist/example1.css"},
+                "backend": "dart",
+            }
+        },
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    css = (src_folder / "dist" / "example1.css").read_text("utf8")
+    assert "color:purple" in css
+    assert "sourceMappingURL" not in css
+    assert not (src_folder / "dist" / "example1.scss.map.json").exists()
+
+    config = create_config(
+        src_folder,
+        {
+            "sass": {
+                "files": {"src/example1.scss": "dist/example1.css"},
+                "backend": "dart",
+                "sourcemap": True,
+            }
+        },
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    css_with_map = (src_folder / "dist" / "example1.css").read_text("utf8")
+    assert css_with_map.startswith(css.split("\n")[0])
+    assert "sourceMappingURL=example1.scss.map.json" in css_with_map
+    sourcemap = json.loads(
+        (src_folder / "dist" / "example1.scss.map.json").read_text("utf8")
+    )
+    assert sourcemap["file"] == "example1.css"
+    assert sorted(sourcemap["sources"]) == [
+        "../src/example1.scss",
+        "../src/partials/_example1.scss",
+    ]
+
+    config = create_config(
+        src_folder,
+        {
+            "sass": {
+                "files": {"src/example1.scss": "dist/example1.[hash].css"},
+                "backend": "dart",
+                "sourcemap": True,
+            }
+        },
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    sourcemap = json.loads(
+        (src_folder / "dist" / "example1.scss.map.json").read_text("utf8")
+    )
+    assert sourcemap["file"] == "example1.css"
+
+
 def test_sass_sourcemap(src_folder: Path):
     config = create_config(
         src_folder,
@@ -87,10 +229,150 @@ def test_sass_hash(src_folder: Path):
     assert result.exit_code == 3, result.output
 
     assert (
-        src_folder / "dist" / "example1.ba380fe0e8b24cb752044f2edcd66d87.css"
+        src_folder / "dist" / "example1.5ff1d3fa41a1d18721c028abee4fb5b9.css"
     ).exists(), result.output
 
 
+def test_jobs(src_folder: Path):
+    config = create_config(
+        src_folder,
+        {
+            "sass_files": {
+                "src/example1.scss": "dist/example1.css",
+                "src/example2.scss": "dist/example2.css",
+            },
+            "js_files": {
+                "src/example1.js": "dist/example1.js",
+                "src/example2.js": "dist/example2.js",
+            },
+        },
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config), "--jobs", "2"])
+    assert result.exit_code == 3, result.output
+    assert len(list((src_folder / "dist").glob("*"))) == 4
+
+
+def test_sass_cache(src_folder: Path):
+    config = create_config(
+        src_folder, {"sass_files": {"src/example1.scss": "dist/example1.css"}}
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    assert (src_folder / ".web-compile-cache" / "sass.json").exists()
+    assert (src_folder / ".web-compile-cache" / ".gitignore").exists()
+
+    # changing an imported partial should invalidate the cache (even if its mtime is
+    # unchanged)
+    partial = src_folder / "src" / "partials" / "_example1.scss"
+    mtime = partial.stat().st_mtime_ns
+    partial.write_text("div {color: green;}", encoding="utf8")
+    os.utime(partial, ns=(mtime, mtime))
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    assert "green" in (src_folder / "dist" / "example1.css").read_text("utf8")
+
+
+def test_cache_versions(src_folder: Path, monkeypatch):
+    config = create_config(
+        src_folder, {"js_files": {"src/example1.js": "dist/example1.js"}}
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+
+    # cached outputs are re-used, whilst the versions are unchanged
+    cache_path = src_folder / ".web-compile-cache" / "js.json"
+    cache = json.loads(cache_path.read_text("utf8"))
+    for entry in cache["entries"].values():
+        entry[0] = "var cached;\n"
+    cache_path.write_text(json.dumps(cache), "utf8")
+    (src_folder / "dist" / "example1.js").unlink()
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    assert (src_folder / "dist" / "example1.js").read_text("utf8") == "var cached;\n"
+
+    # upgrading the package invalidates them
+    monkeypatch.setattr("web_compile.__version__", "0.0.0")
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    assert "cached" not in (src_folder / "dist" / "example1.js").read_text("utf8")
+
+
+def test_sass_no_cache(src_folder: Path):
+    config = create_config(
+        src_folder, {"sass_files": {"src/example1.scss": "dist/example1.css"}}
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config), "--no-cache"])
+    assert result.exit_code == 3, result.output
+    assert not (src_folder / ".web-compile-cache").exists()
+
+
+def test_cache_dir(src_folder: Path):
+    config = create_config(
+        src_folder,
+        {
+            "sass_files": {"src/example1.scss": "dist/example1.css"},
+            "js_files": {"src/example1.js": "dist/example1.js"},
+            "cache_dir": "other/cache",
+        },
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    assert (src_folder / "other" / "cache" / "sass.json").exists()
+    assert (src_folder / "other" / "cache" / "js.json").exists()
+    assert not (src_folder / ".web-compile-cache").exists()
+
+
+def test_sass_incremental(src_folder: Path):
+    config = create_config(
+        src_folder,
+        {
+            "sass": {
+                "files": {"src/example1.scss": "dist/example1.[hash].css"},
+                "incremental": True,
+                "sourcemap": True,
+            },
+            "verbose": True,
+        },
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    assert (src_folder / ".web-compile-cache" / "sass-state.json").exists()
+
+    # the sources and outputs are unchanged, so compilation is skipped
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 0, result.output
+    assert "Up-to-date:" in result.output, result.output
+
+    # only the stylesheets reached by imports are checked
+    (src_folder / "src" / "unrelated.scss").write_text("a {}", encoding="utf8")
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 0, result.output
+    assert "Up-to-date:" in result.output, result.output
+
+    # changing an imported partial triggers a recompile
+    partial = src_folder / "src" / "partials" / "_example1.scss"
+    partial.write_text("div {color: green;}", encoding="utf8")
+    os.utime(partial, ns=(0, 0))
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    (output,) = (src_folder / "dist").glob("*.css")
+    assert "green" in output.read_text("utf8")
+
+
+def test_sass_hash_remove_old(src_folder: Path):
+    config = create_config(
+        src_folder, {"sass_files": {"src/example1.scss": "dist/example1.[hash].css"}}
+    )
+    (src_folder / "dist").mkdir()
+    (src_folder / "dist" / "example1.old.css").write_text("old", encoding="utf8")
+    (src_folder / "dist" / "other.old.css").write_text("old", encoding="utf8")
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    assert not (src_folder / "dist" / "example1.old.css").exists()
+    assert (src_folder / "dist" / "other.old.css").exists()
+    assert len(list((src_folder / "dist").glob("example1.*.css"))) == 1
+
+
 def test_js_basic(src_folder: Path):
     config = create_config(
         src_folder, {"js_files": {"src/example1.js": "dist/example1.js"}}
@@ -98,6 +380,25 @@ def test_js_basic(src_folder: Path):
     result = CliRunner().invoke(run_compile, ["-c", str(config)])
     assert result.exit_code == 3, result.output
     assert (src_folder / "dist" / "example1.js").exists(), result.output
+    assert not (src_folder / ".web-compile-cache" / "jinja").exists()
+
+
+def test_js_encoding(src_folder: Path):
+    (src_folder / "src" / "latin.js").write_bytes("var a = 'café';".encode("latin1"))
+    config = create_config(src_folder, {"js_files": {"src/latin.js": "dist/latin.js"}})
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 1, result.output
+    assert "can't decode" in result.output
+
+    result = CliRunner().invoke(
+        run_compile, ["-c", str(config), "--js-encoding", "latin1"]
+    )
+    assert result.exit_code == 3, result.output
+    assert (
+        (src_folder / "dist" / "latin.js")
+        .read_bytes()
+        .startswith("var a='café';".encode("latin1"))
+    )
 
 
 def test_js_hash(src_folder: Path):
@@ -108,10 +409,27 @@ def test_js_hash(src_folder: Path):
     assert result.exit_code == 3, result.output
 
     assert (
-        src_folder / "dist" / "example1.4725d39478f0b1676dc24f7b1bbee0ae.js"
+        src_folder / "dist" / "example1.9fef2d350ef98e57c165e54921309d9f.js"
     ).exists(), result.output
 
 
+def test_js_hash_repeated(src_folder: Path):
+    (src_folder / "dist").mkdir()
+    (src_folder / "dist" / "example1.old.old.js").write_text("", "utf8")
+    (src_folder / "dist" / "example1.old.js").write_text("", "utf8")
+    config = create_config(
+        src_folder, {"js_files": {"src/example1.js": "dist/example1.[hash].[hash].js"}}
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+
+    file_hash = "9fef2d350ef98e57c165e54921309d9f"
+    assert sorted(path.name for path in (src_folder / "dist").glob("*")) == [
+        f"example1.{file_hash}.{file_hash}.js",
+        "example1.old.js",
+    ]
+
+
 def test_jinja_basic(src_folder: Path):
     config = create_config(
         src_folder,
@@ -128,6 +446,41 @@ def test_jinja_basic(src_folder: Path):
     assert "b" in (src_folder / "dist" / "example1.txt").read_text("utf8")
 
 
+def test_jinja_outside_root(src_folder: Path):
+    (src_folder / "site").mkdir()
+    config = create_config(
+        src_folder / "site",
+        {
+            "jinja": {
+                "files": {"../src/example1.j2": "dist/example1.txt"},
+                "variables": {"a": "b"},
+            }
+        },
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config), "--no-git-add"])
+    assert result.exit_code == 3, result.output
+    assert "b" in (src_folder / "site" / "dist" / "example1.txt").read_text("utf8")
+
+
+def test_jinja_bytecode_cache(src_folder: Path):
+    config = create_config(
+        src_folder,
+        {
+            "jinja": {
+                "files": {"src/example1.j2": "dist/example1.txt"},
+                "variables": {"a": "b"},
+            }
+        },
+    )
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 3, result.output
+    assert list((src_folder / ".web-compile-cache" / "jinja").glob("*"))
+
+    # re-run, using the cached bytecode
+    result = CliRunner().invoke(run_compile, ["-c", str(config)])
+    assert result.exit_code == 0, result.output
+
+
 def test_jinja_hash(src_folder: Path):
     config = create_config(
         src_folder,
@@ -192,8 +545,8 @@ def test_full(src_folder: Path):
     assert (src_folder / "dist" / "example2.txt").exists(), result.output
     text = (src_folder / "dist" / "example2.txt").read_text("utf8")
     # print(text)
-    assert "example1.120bc14042c23711b51a07133e9dcabd.css" in text, text
-    assert "example1.4725d39478f0b1676dc24f7b1bbee0ae.js" in text, text
+    assert "example1.75a581f470f764ff62611ef94de48d2d.css" in text, text
+    assert "example1.9fef2d350ef98e57c165e54921309d9f.js" in text, text
     assert len(list((src_folder / "dist").glob("*"))) == 7
 
     # re-run
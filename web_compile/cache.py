@@ -0,0 +1,90 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+DEFAULT_CACHE_DIR = ".web-compile-cache"
+# increment when the format of cached values changes, to invalidate existing caches
+CACHE_VERSION = 3
+
+
+def fingerprint(*parts: Any) -> str:
+    """Create a cache key from a sequence of bytes or ``repr``-able parts."""
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        hasher.update(part if isinstance(part, bytes) else repr(part).encode("utf8"))
+    return hasher.hexdigest()
+
+
+def make_cache_dir(path: Path):
+    """Create a cache folder, if missing.
+
+    A ``.gitignore`` is added to new folders, so that they are not committed.
+    """
+    if path.is_dir():
+        return
+    try:
+        path.mkdir(parents=True)
+    except FileExistsError:
+        return
+    (path / ".gitignore").write_text("# created by web-compile\n*\n", "utf8")
+
+
+def load_state(path: Path) -> dict:
+    """Load a JSON state file, or return an empty dict if missing or invalid."""
+    try:
+        return json.loads(path.read_text("utf8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(path: Path, state: dict):
+    """Save a JSON state file."""
+    make_cache_dir(path.parent)
+    path.write_text(json.dumps(state, indent=2, sort_keys=True), "utf8")
+
+
+class CompileCache:
+    """A persistent mapping of input fingerprints to compiled outputs.
+
+    Only entries that are accessed or set are kept when saving,
+    so that outdated entries do not accumulate.
+    """
+
+    def __init__(self, path: Optional[Path]):
+        """Load the cache.
+
+        :param path: path to the JSON cache, or None to disable persistence
+        """
+        self.path = path
+        self._loaded: Dict[str, Any] = {}
+        self._entries: Dict[str, Any] = {}
+        if path is not None:
+            # a missing, corrupt or incompatible cache is simply discarded
+            data = load_state(path)
+            if data.get("version") == CACHE_VERSION and isinstance(
+                data.get("entries"), dict
+            ):
+                self._loaded = data["entries"]
+
+    def get(self, key: str) -> Any:
+        """Return the cached value for a key, or None if not present."""
+        if key in self._entries:
+            return self._entries[key]
+        value = self._loaded.get(key)
+        if value is not None:
+            self._entries[key] = value
+        return value
+
+    def set(self, key: str, value: Any):
+        """Set the cached value for a key."""
+        self._entries[key] = value
+
+    def save(self):
+        """Write the cache to disk, if it has changed."""
+        if self.path is None or self._entries == self._loaded:
+            return
+        make_cache_dir(self.path.parent)
+        self.path.write_text(
+            json.dumps({"version": CACHE_VERSION, "entries": self._entries}), "utf8"
+        )
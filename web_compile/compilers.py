@@ -0,0 +1,1054 @@
+"""Compilation of web assets.
+
+This is kept separate from the CLI, so that it can be compiled with mypyc
+(which does not support the function attributes set by click decorators).
+"""
+from collections import deque
+import fnmatch
+import functools
+import glob
+import hashlib
+import importlib
+import os
+from pathlib import Path
+import re
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+import click
+import yaml
+
+try:
+    # use the (much faster) libyaml implementation, if available
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:  # pragma: no cover
+    from yaml import SafeDumper
+
+from .cache import (
+    CompileCache,
+    fingerprint,
+    load_state,
+    make_cache_dir,
+    save_state,
+)
+
+if TYPE_CHECKING:  # pragma: no cover
+    import jinja2
+
+T = TypeVar("T")
+
+# below this many items, starting a process pool costs more than it saves
+_MIN_PROCESS_BATCH = 16
+# ``(input_path, output_path, data, sidecars, error)`` for a compiled input
+_Output = Tuple[Path, Path, Optional[bytes], Dict[str, bytes], Optional[str]]
+
+
+def dump_errors(compilation_errors: dict) -> str:
+    """Format compilation errors as YAML, with block-style messages."""
+    return yaml.dump(compilation_errors, Dumper=SafeDumper, default_style="|")
+
+
+def compile_sass(
+    sass_files: dict,
+    root: Path,
+    sass_format: str,
+    sass_precision: int,
+    sass_sourcemap: bool,
+    sass_encoding: str,
+    sass_backend: str,
+    sass_incremental: bool,
+    cache_dir: Path,
+    use_cache: bool,
+    jobs: Optional[int],
+    new_paths: List[Path],
+    verbose: bool,
+    quiet: bool,
+    test_run: bool,
+    continue_on_error: bool,
+    compilation_errors: Dict[str, str],
+    file_map: Dict[Path, Path],
+) -> bool:
+    """sass compilation."""
+    # missing sass inputs are skipped silently by continue_on_error
+    sass_paths = _check_inputs(
+        "SASS", sass_files, root, continue_on_error, compilation_errors, False
+    )
+
+    # the state of inputs compiled by incremental runs
+    state_path = cache_dir / "sass-state.json"
+    sass_state = {}
+    # the state fingerprint and import graph of each compiled input
+    input_states: Dict[str, Tuple[str, List[str]]] = {}
+    if sass_incremental:
+        previous_state = load_state(state_path)
+        outdated_paths = []
+        for sass_input, sass_output in sass_paths:
+            state_key = _relative_to(sass_input, root).as_posix()
+            record = previous_state.get(state_key)
+            if record is not None and record["inputs"] == _sass_state_fingerprint(
+                sass_input,
+                sass_output,
+                sass_format,
+                sass_precision,
+                sass_sourcemap,
+                sass_backend,
+                record.get("stylesheets", []),
+            ):
+                current_output = root / record["output"]
+                if (
+                    _output_mtimes(sass_input, current_output, sass_sourcemap)
+                    == record["mtimes"]
+                ):
+                    sass_state[state_key] = record
+                    file_map[_relative_to(sass_input, root)] = Path(record["output"])
+                    if verbose:
+                        click.echo(
+                            f"Up-to-date: {str(sass_input)} -> {str(current_output)}"
+                        )
+                    continue
+            outdated_paths.append((sass_input, sass_output))
+        sass_paths = outdated_paths
+
+    source_bytes = _read_inputs(
+        "SASS", sass_paths, continue_on_error, compilation_errors
+    )
+    sass_paths = [paths for paths in sass_paths if paths[0] in source_bytes]
+    stylesheets: Dict[str, bytes] = {}
+    imports = [
+        _import_graph(str(sass_input), source_bytes[sass_input], stylesheets)
+        for sass_input, _ in sass_paths
+    ]
+    if sass_incremental:
+        # recorded before compiling, so that any later changes are picked up
+        for (sass_input, sass_output), graph in zip(sass_paths, imports):
+            input_states[_relative_to(sass_input, root).as_posix()] = (
+                _sass_state_fingerprint(
+                    sass_input,
+                    sass_output,
+                    sass_format,
+                    sass_precision,
+                    sass_sourcemap,
+                    sass_backend,
+                    graph,
+                ),
+                graph,
+            )
+
+    _STYLESHEET_SOURCES.clear()
+    # libsass holds the GIL, so compile in worker processes, then write serially
+    results = _map_cached(
+        cache_dir / "sass.json" if use_cache else None,
+        [
+            _sass_cache_key(
+                sass_input,
+                sass_output,
+                sass_format,
+                sass_precision,
+                sass_sourcemap,
+                sass_backend,
+                graph,
+                stylesheets,
+            )
+            for (sass_input, sass_output), graph in zip(sass_paths, imports)
+        ],
+        ("sass_embedded",) if sass_backend == "dart" else ("sass",),
+        _compile_sass_file,
+        [
+            (
+                sass_input,
+                sass_output,
+                sass_format,
+                sass_precision,
+                sass_sourcemap,
+                sass_backend,
+            )
+            for sass_input, sass_output in sass_paths
+        ],
+        jobs,
+        test_run,
+    )
+
+    outputs: List[_Output] = []
+    for (sass_input, sass_output), (css_str, sourcemap_str, error) in zip(
+        sass_paths, results
+    ):
+        sidecars = {}
+        if error is None and sass_sourcemap:
+            sidecars[sass_input.name + ".map.json"] = sourcemap_str.encode(
+                sass_encoding
+            )
+        css_bytes = None if error is not None else css_str.encode(sass_encoding)
+        outputs.append((sass_input, sass_output, css_bytes, sidecars, error))
+
+    changed_files, written = _write_outputs(
+        "SASS",
+        outputs,
+        root,
+        new_paths,
+        verbose,
+        quiet,
+        test_run,
+        continue_on_error,
+        compilation_errors,
+        file_map,
+    )
+
+    if sass_incremental:
+        for sass_input, sass_output in written:
+            state_key = _relative_to(sass_input, root).as_posix()
+            sass_state[state_key] = {
+                "inputs": input_states[state_key][0],
+                "stylesheets": input_states[state_key][1],
+                "output": _relative_to(sass_output, root).as_posix(),
+                "mtimes": _output_mtimes(sass_input, sass_output, sass_sourcemap),
+            }
+        if not test_run:
+            save_state(state_path, sass_state)
+
+    return changed_files
+
+
+def _check_inputs(
+    kind: str,
+    files: Optional[dict],
+    root: Path,
+    continue_on_error: bool,
+    compilation_errors: Dict[str, str],
+    report_skipped: bool = True,
+) -> List[Tuple[Path, Path]]:
+    """Resolve an ``input: output`` file mapping, checking that the inputs exist.
+
+    :param report_skipped: whether missing inputs skipped by ``continue_on_error``
+        are recorded as compilation errors
+    :return: the ``(input_path, output_path)`` of existing inputs
+    """
+    paths = []
+    input_dirs: Dict[Path, Set[str]] = {}
+    for input_str, output_str in (files or {}).items():
+        input_path = root / input_str
+        if not _in_dir(input_dirs, input_path):
+            if continue_on_error:
+                if report_skipped:
+                    compilation_errors[str(input_path)] = "Path does not exist"
+                continue
+            compilation_errors[str(input_path)] = "Path does not exist"
+            raise _compilation_failed(kind, compilation_errors)
+        paths.append((input_path, root / output_str))
+    return paths
+
+
+def _compilation_failed(
+    kind: str, compilation_errors: Dict[str, str]
+) -> click.ClickException:
+    """Create the exception raised on the first compilation error."""
+    return click.ClickException(
+        f"{kind} compilation failed:\n{dump_errors(compilation_errors)}"
+    )
+
+
+def _map_cached(
+    cache_path: Optional[Path],
+    cache_keys: List[str],
+    compilers: Tuple[str, ...],
+    func: Callable[..., tuple],
+    args_list: List[tuple],
+    jobs: Optional[int],
+    test_run: bool,
+) -> List[tuple]:
+    """Apply ``func`` to each argument tuple in parallel, re-using cached results.
+
+    ``func`` must return a tuple of JSON-serializable values,
+    ending with an error message (or None), and only successful results are cached.
+
+    :param cache_path: path to the persistent cache, or None to disable it
+    :param compilers: the modules used by ``func``, whose versions (and that of
+        this package) are added to the cache keys, so that upgrades invalidate them
+    """
+    cache = CompileCache(cache_path)
+    if cache_path is not None and cache_keys:
+        versions = _versions(compilers)
+        cache_keys = [fingerprint(versions, key) for key in cache_keys]
+    # JSON stores tuples as lists
+    results: List[Any] = [
+        None if value is None else tuple(value)
+        for value in (cache.get(key) for key in cache_keys)
+    ]
+    missing = [index for index, result in enumerate(results) if result is None]
+    computed = map_parallel(func, [args_list[index] for index in missing], jobs)
+    for index, result in zip(missing, computed):
+        results[index] = result
+        if result[-1] is None:
+            cache.set(cache_keys[index], result)
+    if not test_run:
+        cache.save()
+    return results
+
+
+def _versions(modules: Tuple[str, ...]) -> List[str]:
+    """Return the versions of this package and the given (importable) modules."""
+    from . import __version__
+
+    versions = [__version__]
+    for name in modules:
+        try:
+            versions.append(getattr(importlib.import_module(name), "__version__", ""))
+        except ImportError:
+            versions.append("")
+    return versions
+
+
+def _write_outputs(
+    kind: str,
+    outputs: List[_Output],
+    root: Path,
+    new_paths: List[Path],
+    verbose: bool,
+    quiet: bool,
+    test_run: bool,
+    continue_on_error: bool,
+    compilation_errors: Dict[str, str],
+    file_map: Optional[Dict[Path, Path]] = None,
+) -> Tuple[bool, List[Tuple[Path, Path]]]:
+    """Write compiled outputs, and their sidecar files (e.g. source maps).
+
+    :param outputs: ``(input_path, output_path, data, sidecars, error)`` per input,
+        where ``sidecars`` maps file names (in the output folder) to their content
+    :param file_map: if given, ``[hash]`` in output names is replaced by the content
+        hash (removing previous outputs), and the output paths are recorded in it
+    :return: whether any files changed, and the ``(input_path, output_path)`` written
+    """
+    changed_files = False
+    written = []
+    output_dirs: Dict[Path, List[str]] = {}
+    for input_path, output_path, data, sidecars, error in outputs:
+        if error is not None:
+            compilation_errors[str(input_path)] = error
+            if continue_on_error:
+                continue
+            raise _compilation_failed(kind, compilation_errors)
+        assert data is not None
+
+        name_parts = output_path.name.split("[hash]")
+        if file_map is not None and len(name_parts) > 1:
+            file_hash = hash_file(data)
+            new_output_path = output_path.parent / file_hash.join(name_parts)
+            output_names = _list_dir(output_dirs, output_path.parent)
+            # escaped, so that other brackets in the name are not character classes
+            old_pattern = "*".join(glob.escape(part) for part in name_parts)
+            for old_name in fnmatch.filter(output_names, old_pattern):
+                if old_name == new_output_path.name:
+                    continue
+                old_output = output_path.parent / old_name
+                if verbose:
+                    click.secho(f"Removed: {str(old_output)}", fg="yellow")
+                if not test_run:
+                    changed_files = True
+                    old_output.unlink()
+                    output_names.remove(old_name)
+            output_path = new_output_path
+
+        if file_map is not None:
+            file_map[_relative_to(input_path, root)] = _relative_to(output_path, root)
+
+        if update_file(
+            output_path,
+            data,
+            verbose,
+            quiet,
+            test_run,
+            input_path,
+            new_paths,
+        ):
+            changed_files = True
+
+        for name, sidecar_data in sidecars.items():
+            if update_file(
+                output_path.parent / name,
+                sidecar_data,
+                verbose,
+                quiet,
+                test_run,
+                input_path,
+                new_paths,
+            ):
+                changed_files = True
+
+        written.append((input_path, output_path))
+
+    return changed_files, written
+
+
+def _scan_dir(directory: Path) -> List[str]:
+    """Return the entry names in a directory (empty if it cannot be listed)."""
+    try:
+        with os.scandir(directory) as entries:
+            return [entry.name for entry in entries]
+    except OSError:
+        return []
+
+
+def _list_dir(index: Dict[Path, List[str]], directory: Path) -> List[str]:
+    """Return the entry names in a directory, scanning it only once per ``index``."""
+    if directory not in index:
+        index[directory] = _scan_dir(directory)
+    return index[directory]
+
+
+def _in_dir(index: Dict[Path, Set[str]], path: Path) -> bool:
+    """Return whether a path exists, from a (single) scan of its parent folder.
+
+    This replaces a ``stat`` per input with a ``scandir`` per input folder.
+    Names are matched exactly, so on case-insensitive file systems,
+    a name not in the listing falls back to ``exists``.
+    """
+    if path.parent not in index:
+        index[path.parent] = set(_scan_dir(path.parent))
+    return path.name in index[path.parent] or path.exists()
+
+
+def _sass_state_fingerprint(
+    sass_input: Path,
+    sass_output: Path,
+    sass_format: str,
+    sass_precision: int,
+    sass_sourcemap: bool,
+    sass_backend: str,
+    stylesheets: List[str],
+) -> str:
+    """Fingerprint the state of a sass input, for incremental compilation.
+
+    This includes the modification times of the input and the stylesheets it
+    imports (as found by ``_import_graph``), and the compilation options.
+    """
+    return fingerprint(
+        [(path, _mtime_ns(path)) for path in stylesheets],
+        str(sass_input),
+        str(sass_output),
+        sass_format,
+        sass_precision,
+        sass_sourcemap,
+        sass_backend,
+    )
+
+
+def _mtime_ns(path: str) -> Optional[int]:
+    """Return the modification time of a file, or None if it is missing."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _output_mtimes(
+    sass_input: Path, sass_output: Path, sass_sourcemap: bool
+) -> Optional[List[int]]:
+    """Return the modification times of the outputs for a sass input,
+    or None if any are missing."""
+    paths = [sass_output]
+    if sass_sourcemap:
+        paths.append(sass_output.parent / (sass_input.name + ".map.json"))
+    try:
+        return [path.stat().st_mtime_ns for path in paths]
+    except FileNotFoundError:
+        return None
+
+
+def _sass_cache_key(
+    sass_input: Path,
+    sass_output: Path,
+    sass_format: str,
+    sass_precision: int,
+    sass_sourcemap: bool,
+    sass_backend: str,
+    imports: List[str],
+    stylesheets: Dict[str, bytes],
+) -> str:
+    """Fingerprint the inputs of a sass compilation.
+
+    This includes the content of all stylesheets that the input (transitively)
+    imports, so that changes to partials are picked up.
+
+    :param imports: the input and the stylesheets it imports, from ``_import_graph``
+    :param stylesheets: the contents of the stylesheets
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    for path in imports:
+        data = stylesheets[path]
+        hasher.update(f"{path}:{len(data)}:".encode("utf8"))
+        hasher.update(data)
+    return fingerprint(
+        hasher.hexdigest(),
+        _relpath(sass_input.parent, sass_output.parent),
+        sass_output.name,
+        sass_format,
+        sass_precision,
+        sass_sourcemap,
+        sass_backend,
+    )
+
+
+_IMPORT_RULE = re.compile(rb"@(?:import|use|forward)\s+((?:,\s*|[^;\n])+)")
+_IMPORT_URL = re.compile(rb"[\"']([^\"']+)[\"']")
+
+
+def _import_graph(
+    sass_input: str, sass_bytes: bytes, stylesheets: Dict[str, bytes]
+) -> List[str]:
+    """Return the (sorted) paths of a stylesheet and all the stylesheets it imports.
+
+    Imports are found with a regex (over-matching, e.g. in comments, is harmless),
+    and resolved relative to the importing file, then the input's folder,
+    as for the include paths passed to the compiler.
+
+    :param stylesheets: stylesheet contents read so far, shared between inputs
+    """
+    include_path = os.path.dirname(sass_input)
+    stylesheets[sass_input] = sass_bytes
+    found = {sass_input}
+    queue = deque([sass_input])
+    while queue:
+        path = queue.popleft()
+        for url in _parse_imports(path, stylesheets[path]):
+            for directory in (os.path.dirname(path), include_path):
+                for candidate in _import_candidates(os.path.join(directory, url)):
+                    if candidate in found:
+                        continue
+                    if candidate not in stylesheets:
+                        try:
+                            stylesheets[candidate] = _slurp(candidate)
+                        except OSError:
+                            continue
+                    found.add(candidate)
+                    queue.append(candidate)
+    return sorted(found)
+
+
+def _parse_imports(path: str, data: bytes) -> List[str]:
+    """Return the URLs of the ``@import``, ``@use`` and ``@forward`` rules."""
+    urls: List[str] = []
+    for match in _IMPORT_RULE.finditer(data):
+        quoted = _IMPORT_URL.findall(match.group(1))
+        if not quoted and path.endswith(".sass"):
+            # the indented syntax allows unquoted imports
+            quoted = [url.strip() for url in match.group(1).split(b",")]
+        urls.extend(url.decode("utf8", "replace") for url in quoted)
+    return [url for url in urls if url and not url.startswith("sass:")]
+
+
+def _import_candidates(path: str) -> List[str]:
+    """Return the stylesheet paths that an import may resolve to."""
+    directory, name = os.path.split(path)
+    if name.endswith((".scss", ".sass", ".css")):
+        names = [name, "_" + name]
+    else:
+        names = [
+            prefix + name + suffix
+            for suffix in (".scss", ".sass", ".css")
+            for prefix in ("_", "")
+        ] + [
+            os.path.join(name, prefix + "index" + suffix)
+            for suffix in (".scss", ".sass")
+            for prefix in ("_", "")
+        ]
+    return [os.path.join(directory, name) for name in names]
+
+
+# stylesheet sources read by ``_import_stylesheet``, cleared for each compilation run
+_STYLESHEET_SOURCES: Dict[str, str] = {}
+
+
+def _import_stylesheet(path: str, prev: str) -> Optional[List[Tuple[str, str]]]:
+    """A libsass importer, which reads each imported stylesheet only once.
+
+    Only unambiguous ``.scss`` files, relative to the importing file, are handled;
+    everything else falls back to the default libsass resolution.
+    """
+    if os.path.splitext(path)[1] or "//" in path:
+        return None
+    directory, name = os.path.split(os.path.join(os.path.dirname(prev), path))
+    candidates = [
+        os.path.join(directory, prefix + name + suffix)
+        for suffix in (".scss", ".sass", ".css")
+        for prefix in ("_", "")
+    ]
+    found = [candidate for candidate in candidates if os.path.isfile(candidate)]
+    if len(found) != 1 or not found[0].endswith(".scss"):
+        return None
+    if found[0] not in _STYLESHEET_SOURCES:
+        _STYLESHEET_SOURCES[found[0]] = _slurp(found[0]).decode("utf8")
+    return [(found[0], _STYLESHEET_SOURCES[found[0]])]
+
+
+def _compile_sass_file(
+    sass_input: Path,
+    sass_output: Path,
+    sass_format: str,
+    sass_precision: int,
+    sass_sourcemap: bool,
+    sass_backend: str,
+) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Compile a single sass file, returning ``(css, sourcemap, error)``.
+
+    This may be run in a worker process, so must not mutate the caller's state.
+    """
+    if sass_backend == "dart":
+        return _compile_sass_file_dart(
+            sass_input, sass_output, sass_format, sass_sourcemap
+        )
+
+    import sass
+
+    sass_input_str = str(sass_input)
+    try:
+        css_str, sourcemap_str = sass.compile(
+            filename=sass_input_str,
+            include_paths=[_absolute_path(sass_input.parent)],
+            importers=[(0, _import_stylesheet)],
+            output_style=sass_format,
+            precision=sass_precision,
+            source_map_filename=sass_input_str + ".map.json",
+            omit_source_map_url=(not sass_sourcemap),
+            source_map_root=_relpath(sass_input.parent, sass_output.parent),
+        )
+    except sass.CompileError as err:
+        return None, None, str(err)
+    return css_str, sourcemap_str, None
+
+
+def _compile_sass_file_dart(
+    sass_input: Path, sass_output: Path, sass_format: str, sass_sourcemap: bool
+) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Compile a single sass file with dart-sass, returning ``(css, sourcemap, error)``.
+
+    dart-sass only writes to files, so the outputs are read back from a temporary
+    folder, and the source map is rewritten relative to the actual output folder.
+    """
+    if sass_format not in ("expanded", "compressed"):
+        return None, None, f"The dart backend does not support format: {sass_format}"
+    try:
+        import sass_embedded
+    except ImportError:
+        return None, None, "The dart backend requires: pip install web-compile[dart]"
+    import json
+    import tempfile
+    from urllib.parse import urlparse
+    from urllib.request import url2pathname
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        dest = Path(tmpdir) / "output.css"
+        result = sass_embedded.compile_file(
+            sass_input,
+            dest,
+            load_paths=[sass_input.parent],
+            style="compressed" if sass_format == "compressed" else "expanded",
+            no_sourcemap=(not sass_sourcemap),
+            source_urls="absolute",
+        )
+        if not result.ok:
+            return None, None, result.error
+        css_str = dest.read_text("utf8")
+        if not sass_sourcemap:
+            return css_str, None, None
+        sourcemap = json.loads(dest.with_name("output.css.map").read_text("utf8"))
+
+    map_name = sass_input.name + ".map.json"
+    css_str = css_str.replace(
+        "sourceMappingURL=output.css.map", f"sourceMappingURL={map_name}"
+    )
+    # as for libsass, which names the output after the input (before any ``[hash]``)
+    sourcemap["file"] = sass_input.stem + ".css"
+    sourcemap["sources"] = [
+        Path(
+            _relpath(url2pathname(urlparse(source).path), sass_output.parent)
+        ).as_posix()
+        if source.startswith("file:")
+        else source
+        for source in sourcemap["sources"]
+    ]
+    return css_str, json.dumps(sourcemap), None
+
+
+@functools.lru_cache(maxsize=None)
+def _absolute_path(path: Path) -> str:
+    """Memoized ``str(path.absolute())``, since sibling inputs share parents."""
+    return str(path.absolute())
+
+
+# memoized, since sibling inputs share the same input/output folders
+_relpath = functools.lru_cache(maxsize=None)(os.path.relpath)
+
+
+@functools.lru_cache(maxsize=None)
+def _relative_to(path: Path, root: Path) -> Path:
+    """Memoized ``path.relative_to(root)``, since each input path is used as
+    (part of) a key several times."""
+    return path.relative_to(root)
+
+
+def map_parallel(
+    func: Callable[..., T],
+    args_list: List[tuple],
+    jobs: Optional[int] = None,
+    threads: bool = False,
+) -> List[T]:
+    """Apply ``func`` to each argument tuple, using a worker pool if ``jobs > 1``.
+
+    Without an explicit ``jobs``, process pools are only used for batches
+    of at least ``_MIN_PROCESS_BATCH``.
+
+    :param jobs: maximum number of workers (default: CPU count)
+    :param threads: use threads rather than processes, for work that releases
+        the GIL (e.g. IO)
+    """
+    if jobs is None:
+        if not threads and len(args_list) < _MIN_PROCESS_BATCH:
+            jobs = 1
+        else:
+            jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(args_list))
+    if jobs <= 1:
+        return [func(*args) for args in args_list]
+    from concurrent import futures
+
+    executor_class = (
+        futures.ThreadPoolExecutor if threads else futures.ProcessPoolExecutor
+    )
+    with executor_class(max_workers=jobs) as executor:
+        return list(executor.map(func, *zip(*args_list)))
+
+
+def _read_inputs(
+    kind: str,
+    paths: List[Tuple[Path, Path]],
+    continue_on_error: bool,
+    compilation_errors: Dict[str, str],
+    jobs: int = 8,
+) -> Dict[Path, bytes]:
+    """Read the inputs in a thread pool, so that their IO overlaps.
+
+    Unreadable inputs (e.g. folders) are recorded as compilation errors, and omitted.
+    """
+    results = map_parallel(
+        _read_file, [(input_path,) for input_path, _ in paths], jobs, True
+    )
+    contents = {}
+    for (input_path, _), (content, error) in zip(paths, results):
+        if content is None:
+            compilation_errors[str(input_path)] = str(error)
+            if continue_on_error:
+                continue
+            raise _compilation_failed(kind, compilation_errors)
+        contents[input_path] = content
+    return contents
+
+
+def _read_file(path: Path) -> Tuple[Optional[bytes], Optional[str]]:
+    """Read a file, returning ``(content, error)``."""
+    try:
+        return _slurp(path), None
+    except OSError as err:
+        return None, str(err)
+
+
+def minify_js(
+    js_files: dict,
+    root: Path,
+    js_comments: bool,
+    js_encoding: str,
+    cache_dir: Path,
+    use_cache: bool,
+    jobs: Optional[int],
+    new_paths: List[Path],
+    verbose: bool,
+    quiet: bool,
+    test_run: bool,
+    continue_on_error: bool,
+    compilation_errors: Dict[str, str],
+    file_map: Dict[Path, Path],
+) -> bool:
+    """JS minification."""
+    js_paths = _check_inputs(
+        "JS", js_files, root, continue_on_error, compilation_errors
+    )
+
+    source_bytes = _read_inputs("JS", js_paths, continue_on_error, compilation_errors)
+    js_paths = [paths for paths in js_paths if paths[0] in source_bytes]
+    results = _map_cached(
+        cache_dir / "js.json" if use_cache else None,
+        [
+            fingerprint(source_bytes[input_path], js_comments, js_encoding)
+            for input_path, _ in js_paths
+        ],
+        ("rjsmin",),
+        _minify_js_file,
+        [
+            (source_bytes[input_path], js_comments, js_encoding)
+            for input_path, _ in js_paths
+        ],
+        jobs,
+        test_run,
+    )
+
+    changed_files, _ = _write_outputs(
+        "JS",
+        [
+            (
+                input_path,
+                output_path,
+                None if error is not None else js_str.encode(js_encoding),
+                {},
+                error,
+            )
+            for (input_path, output_path), (js_str, error) in zip(js_paths, results)
+        ],
+        root,
+        new_paths,
+        verbose,
+        quiet,
+        test_run,
+        continue_on_error,
+        compilation_errors,
+        file_map,
+    )
+    return changed_files
+
+
+def _minify_js_file(
+    source: bytes, js_comments: bool, js_encoding: str
+) -> Tuple[Optional[str], Optional[str]]:
+    """Minify the content of a single JS file, returning ``(js, error)``.
+
+    This may be run in a worker process, so must not mutate the caller's state.
+    """
+    import rjsmin
+
+    try:
+        js_str = rjsmin.jsmin(source.decode(js_encoding), js_comments)
+        # ensure compatibility with end-of-file-fixer
+        return js_str.rstrip() + os.linesep, None
+    except Exception as err:
+        return None, str(err)
+
+
+def compile_jinja(
+    jinja_files: Optional[dict],
+    root: Path,
+    jinja_encoding: str,
+    jinja_variables: Optional[dict],
+    cache_dir: Path,
+    use_cache: bool,
+    jobs: Optional[int],
+    new_paths: List[Path],
+    verbose: bool,
+    quiet: bool,
+    test_run: bool,
+    continue_on_error: bool,
+    compilation_errors: Dict[str, str],
+    file_map: Dict[Path, Path],
+) -> bool:
+    """Jinja compilation."""
+    jinja_paths = _check_inputs(
+        "Jinja", jinja_files, root, continue_on_error, compilation_errors
+    )
+    if not jinja_paths:
+        return False
+
+    import jinja2
+
+    # parsed templates are cached in memory by the loader,
+    # and their compiled bytecode is cached on disk, across runs
+    bytecode_cache = None
+    if use_cache and not test_run:
+        make_cache_dir(cache_dir)
+        (cache_dir / "jinja").mkdir(exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(str(cache_dir / "jinja"))
+    jinja_env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(str(root), encoding=jinja_encoding),
+        bytecode_cache=bytecode_cache,
+    )
+    jinja_env.globals.update(jinja_variables or {})
+
+    # templates may reference the same path many times, so memoize the filters
+    @functools.lru_cache(maxsize=None)
+    def _get_compiled_name(path):
+        compiled_path = file_map.get(Path(path)) if path else None
+        if compiled_path is None:
+            raise KeyError(f"No compiled path: {path}")
+        return compiled_path.name
+
+    @functools.lru_cache(maxsize=None)
+    def _get_hash(path):
+        if not path or Path(path) not in file_map:
+            raise KeyError(f"No compiled path: {path}")
+        return hash_path(root / path)
+
+    jinja_env.filters["compiled_name"] = _get_compiled_name
+    jinja_env.filters["hash"] = _get_hash
+
+    # load all templates up-front, so that their reads overlap,
+    # then render them in order (since rendering may depend on the file_map)
+    templates = map_parallel(
+        _load_template,
+        [
+            (jinja_env, root, input_path, jinja_encoding)
+            for input_path, _ in jinja_paths
+        ],
+        jobs,
+        threads=True,
+    )
+
+    outputs: List[_Output] = []
+    for (input_path, output_path), (template, error) in zip(jinja_paths, templates):
+        jinja_bytes = None
+        if template is not None:
+            try:
+                jinja_str = template.render()
+                # ensure compatibility with end-of-file-fixer
+                jinja_str = jinja_str.rstrip() + os.linesep
+                jinja_bytes = jinja_str.encode(jinja_encoding)
+            except Exception as err:
+                error = str(err)
+        outputs.append((input_path, output_path, jinja_bytes, {}, error))
+
+    changed_files, _ = _write_outputs(
+        "Jinja",
+        outputs,
+        root,
+        new_paths,
+        verbose,
+        quiet,
+        test_run,
+        continue_on_error,
+        compilation_errors,
+    )
+    return changed_files
+
+
+def _load_template(
+    jinja_env: "jinja2.Environment", root: Path, input_path: Path, jinja_encoding: str
+) -> Tuple[Optional["jinja2.Template"], Optional[str]]:
+    """Load (parse and compile) a single template, returning ``(template, error)``.
+
+    This may be run in a worker thread.
+    """
+    import jinja2
+
+    try:
+        name = Path(os.path.normpath(_relative_to(input_path, root))).as_posix()
+        try:
+            template = jinja_env.get_template(name)
+        except (ValueError, jinja2.TemplateNotFound):
+            # the loader can only load templates within the root folder
+            template = jinja_env.from_string(input_path.read_text(jinja_encoding))
+    except Exception as err:
+        return None, str(err)
+    return template, None
+
+
+def update_file(
+    path: Path,
+    data: bytes,
+    verbose: bool,
+    quiet: bool,
+    test_run: bool,
+    in_path: Path,
+    new_paths: List[Path],
+) -> bool:
+    """Update a file with encoded content.
+
+    :param new_paths: created files are appended to this list
+    """
+    changed = False
+
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        size = None
+
+    if size is None:
+        if not test_run:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _write_bytes(path, data)
+            new_paths.append(path)
+        changed = True
+
+    # a size mismatch is a cheap check, before comparing the content
+    elif size != len(data) or _content_differs(path, data):
+        if not test_run:
+            _write_bytes(path, data)
+        changed = True
+
+    if changed and not quiet:
+        click.secho(f"Compiled: {str(in_path)} -> {str(path)}", fg="blue")
+    if not changed and verbose:
+        click.echo(f"Already Exists: {str(in_path)} -> {str(path)}")
+
+    return changed
+
+
+# avoid newline translation on Windows
+_O_BINARY = getattr(os, "O_BINARY", 0)
+
+
+def _slurp(path: Union[str, Path]) -> bytes:
+    """Read a file's content, using the OS-level API (bypassing the ``io`` stack).
+
+    This has a lower per-call overhead than ``Path.read_bytes``, for small files.
+    """
+    fd = os.open(path, os.O_RDONLY | _O_BINARY)
+    try:
+        size = os.fstat(fd).st_size
+        chunks = [os.read(fd, size or 1 << 16)]
+        # the file may be larger than reported, or the read may be short
+        while chunks[-1]:
+            chunks.append(os.read(fd, 1 << 16))
+    finally:
+        os.close(fd)
+    return b"".join(chunks)
+
+
+def _write_bytes(path: Path, data: bytes) -> None:
+    """Write a file's content, using the OS-level API (bypassing the ``io`` stack)."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _O_BINARY, 0o666)
+    try:
+        view = memoryview(data)
+        written = 0
+        while written < len(data):
+            written += os.write(fd, view[written:])
+    finally:
+        os.close(fd)
+
+
+def _content_differs(path: Path, data: bytes, chunk_size: int = 1 << 20) -> bool:
+    """Compare a file to same-sized ``data``, stopping at the first differing chunk."""
+    with path.open("rb") as handle:
+        for start in range(0, len(data), chunk_size):
+            # compare in place, without slicing data
+            if not data.startswith(handle.read(chunk_size), start):
+                return True
+    return False
+
+
+def hash_file(data: bytes) -> str:
+    """Hash encoded content, for use in file names (a 32 character hex digest)."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def hash_path(path: Path, chunk_size: int = 1 << 20) -> str:
+    """Hash the contents of a file, as for ``hash_file``,
+    reading it in chunks (1 MiB by default)."""
+    hasher = hashlib.blake2b(digest_size=16)
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
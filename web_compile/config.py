@@ -1,22 +1,42 @@
+import copy
 import json
 from pathlib import Path
+from typing import Dict, Tuple
 
 import click
-import toml
 import yaml
 
+try:
+    # use the (much faster) libyaml implementation, if available
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:  # pragma: no cover
+    from yaml import SafeLoader
+
 TOP_LEVEL = "web-compile"
 
+# the last parsed configuration for each path, with its (mtime, size, encoding)
+_CONFIG_CACHE: Dict[str, Tuple[tuple, dict]] = {}
+
 
 def read_config(path: Path, encoding="utf8"):
+    stat = path.stat()
+    key, state = str(path.absolute()), (stat.st_mtime_ns, stat.st_size, encoding)
+    if key not in _CONFIG_CACHE or _CONFIG_CACHE[key][0] != state:
+        _CONFIG_CACHE[key] = (state, _parse_config(path, encoding))
+    return copy.deepcopy(_CONFIG_CACHE[key][1])
+
+
+def _parse_config(path: Path, encoding="utf8"):
     text = path.read_text(encoding)
     if not text:
         raise IOError("File is empty")
     if path.name.endswith(".yml") or path.name.endswith(".yaml"):
-        config = yaml.safe_load(text)
+        config = yaml.load(text, Loader=SafeLoader)
     elif path.name.endswith(".json"):
         config = json.loads(text)
     elif path.name.endswith(".toml"):
+        import toml
+
         config = toml.loads(text)
     else:
         raise IOError("file extension not one of: json, toml, yml, yaml")
@@ -33,8 +53,8 @@ def read_config(path: Path, encoding="utf8"):
     return config
 
 
-def config_callback(ctx: click.Context, param: click.Option, path: str):
-    path = Path(path)
+def config_callback(ctx: click.Context, param: click.Option, value: str) -> Path:
+    path = Path(value)
     if not path.exists():
         raise click.BadOptionUsage(
             param.name, f"Configuration file does not exist: {path}", ctx